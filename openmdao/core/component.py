@@ -1506,6 +1506,10 @@ class Component(System):
                         coloring._check_config_partial(self)
                     self._update_subjac_sparsity(coloring.get_subjac_sparsity())
 
+            # all partials have been declared by now, so keep their values in one contiguous
+            # array before compute_partials gets a reference to any of them
+            self._jacobian._setup_value_pool(list(self._subjacs_info))
+
     def _resolve_src_inds(self, my_tdict, top):
         abs2meta_in = self._var_abs2meta['input']
         all_abs2meta_in = self._var_allprocs_abs2meta['input']
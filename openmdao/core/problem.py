@@ -52,6 +52,10 @@ except ImportError:
 
 from openmdao.utils.name_maps import rel_key2abs_key, rel_name2abs_name
 
+# mpi4py.MPI, or False if mpi4py isn't available.  It's looked up by the first Problem that
+# isn't given a comm rather than at import, since importing mpi4py.MPI initializes MPI.
+_MPI = None
+
 
 ErrorTuple = namedtuple('ErrorTuple', ['forward', 'reverse', 'forward_reverse'])
 MagnitudeTuple = namedtuple('MagnitudeTuple', ['forward', 'reverse', 'fd'])
@@ -142,11 +146,7 @@ class Problem(object):
         self._name = name
 
         if comm is None:
-            try:
-                from mpi4py import MPI
-                comm = MPI.COMM_WORLD
-            except ImportError:
-                comm = FakeComm()
+            comm = _default_comm()
 
         if model is None:
             self.model = Group()
@@ -2419,3 +2419,26 @@ class Slicer(object):
 
 # instance of the Slicer class to be used by users for the set_val and get_val methods of Problem
 slicer = Slicer()
+
+
+def _default_comm():
+    """
+    Return the comm used by a Problem that isn't given one.
+
+    This doesn't depend on OPENMDAO_REQUIRE_MPI, so a Problem uses MPI.COMM_WORLD whenever
+    mpi4py is installed.
+
+    Returns
+    -------
+    MPI.Comm or <FakeComm>
+        MPI.COMM_WORLD if mpi4py is available, otherwise a new FakeComm.
+    """
+    global _MPI
+
+    if _MPI is None:
+        try:
+            from mpi4py import MPI as _MPI
+        except ImportError:
+            _MPI = False
+
+    return _MPI.COMM_WORLD if _MPI else FakeComm()
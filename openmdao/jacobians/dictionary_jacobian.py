@@ -1,7 +1,60 @@
 """Define the DictionaryJacobian class."""
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
+from scipy.sparse import csc_matrix
+
+try:
+    # compiled kernels that accumulate a CSC (or CSR) matvec product directly into the output
+    from scipy.sparse._sparsetools import csc_matvec, csc_matvecs, csr_matvec, csr_matvecs
+except ImportError:
+    csc_matvec = None
 
 from openmdao.jacobians.jacobian import Jacobian
+from openmdao.utils.general_utils import simple_warning
+
+# kinds of subjac products computed in DictionaryJacobian._apply
+_IDENTITY = 0  # explicit output wrt itself, so just subtract
+_COO = 1  # our homegrown COO format, multiplied using a cached CSC matrix
+_MATRIX = 2  # ndarray or scipy sparse matrix
+_FUSED_COO = 3  # all COO subjacs wrt one vector, multiplied using a single CSC matrix
+_BATCHED_DENSE = 4  # small same-shape dense subjacs wrt one vector, multiplied using one matmul
+_FUSED_COO_STATE = 5  # all COO subjacs wrt outputs and inputs, multiplied using one CSC matrix
+
+# dense subjacs larger than this are multiplied individually
+_MAX_BATCHED_SIZE = 256
+
+
+def _get_num_threads():
+    """
+    Return the number of threads given by the OPENMDAO_JAC_THREADS environment variable.
+
+    Returns
+    -------
+    int
+        Number of threads, which is 1 if the variable isn't set or isn't a valid integer.
+    """
+    val = os.environ.get('OPENMDAO_JAC_THREADS', '1')
+    try:
+        return max(int(val), 1)
+    except ValueError:
+        simple_warning("OPENMDAO_JAC_THREADS should be a positive integer but is '%s', so "
+                       "subjac products will not be threaded." % val)
+        return 1
+
+
+# number of threads used to multiply large matrix subjacs concurrently.  numpy releases the
+# GIL during the products, so subjacs that update different variables can run in parallel.
+_NUM_THREADS = _get_num_threads()
+
+# matrix subjacs with fewer nonzero entries than this aren't worth sending to a thread
+_MIN_THREADED_SIZE = 100000
+
+# thread pool used by _apply_threaded and its number of workers, created on first use
+_thread_pool = None
+_thread_pool_size = 0
 
 
 class DictionaryJacobian(Jacobian):
@@ -12,6 +65,17 @@ class DictionaryJacobian(Jacobian):
     ----------
     _iter_keys : list of (vname, vname) tuples
         List of tuples of variable names that match subjacs in the this Jacobian.
+    _iter_keys_by_fingerprint : dict
+        Key lists shared by all vec_names with the same relevant variables, keyed by system
+        pathname and the relevant output and input names.
+    _apply_plans : dict
+        Cache of resolved subjac products, keyed by (system pathname, vec_name, complex step).
+    _scratch_pool : dict
+        Free scratch arrays used by the subjac products, keyed by (shape, dtype).
+    _value_pool : ndarray or None
+        Contiguous array holding the values of the ndarray subjacs of the system.
+    _pool_offsets : dict
+        Starting index of each pooled subjac value in _value_pool, keyed by absolute key.
 
     """
 
@@ -28,6 +92,11 @@ class DictionaryJacobian(Jacobian):
         """
         super().__init__(system, **kwargs)
         self._iter_keys = {}
+        self._iter_keys_by_fingerprint = {}
+        self._apply_plans = {}
+        self._scratch_pool = {}
+        self._value_pool = None
+        self._pool_offsets = {}
 
     def _iter_abs_keys(self, system, vec_name):
         """
@@ -50,19 +119,130 @@ class DictionaryJacobian(Jacobian):
         entry = (system.pathname, vec_name)
 
         if entry not in self._iter_keys:
+            relevant = system._var_relevant_names[vec_name]
+            fingerprint = (system.pathname, frozenset(relevant['output']),
+                           frozenset(relevant['input']))
+
+            # vec_names with the same relevant variables share a single key list
+            if fingerprint in self._iter_keys_by_fingerprint:
+                self._iter_keys[entry] = self._iter_keys_by_fingerprint[fingerprint]
+                return self._iter_keys[entry]
+
+            # avoid circular import
+            from openmdao.core.explicitcomponent import ExplicitComponent
+
+            is_explicit = isinstance(system, ExplicitComponent)
             subjacs = self._subjacs_info
             keys = []
-            for res_name in system._var_relevant_names[vec_name]['output']:
+            for res_name in relevant['output']:
                 for type_ in ('output', 'input'):
-                    for name in system._var_relevant_names[vec_name][type_]:
+                    for name in relevant[type_]:
                         key = (res_name, name)
                         if key in subjacs:
                             keys.append(key)
+                            meta = subjacs[key]
+                            if is_explicit and res_name == name:
+                                # explicit output wrt itself is -identity, so it's never
+                                # multiplied and doesn't need a CSC matrix
+                                meta['is_explicit_identity'] = True
+                            elif meta['rows'] is not None and 'csc' not in meta:
+                                self._setup_csc(system, key, meta)
 
-            self._iter_keys[entry] = keys
+            self._iter_keys[entry] = self._iter_keys_by_fingerprint[fingerprint] = keys
 
         return self._iter_keys[entry]
 
+    def _setup_value_pool(self, keys):
+        """
+        Move the values of the given ndarray subjacs into one contiguous array.
+
+        Each subjac value becomes a view into the pool, so values set in place by the user
+        update the pool directly, and combined COO products can gather all of their values
+        from it with a single take.
+
+        Parameters
+        ----------
+        keys : list of (str, str)
+            Absolute keys of the subjacs to add to the pool.
+        """
+        subjacs = self._subjacs_info
+        keys = [key for key in keys if isinstance(subjacs[key]['value'], np.ndarray)]
+
+        self._pool_offsets = offsets = {}
+        size = 0
+        for key in keys:
+            offsets[key] = size
+            size += subjacs[key]['value'].size
+
+        dtype = complex if self._under_complex_step else float
+        self._value_pool = pool = np.empty(size, dtype=dtype)
+        for key in keys:
+            meta = subjacs[key]
+            value = meta['value']
+            view = pool[offsets[key]:offsets[key] + value.size].reshape(value.shape)
+            view[...] = value
+            meta['value'] = view
+
+    def _map_to_pool(self, fused_info):
+        """
+        Add the pool positions of the values of the given combined COO subjacs to their metadata.
+
+        Parameters
+        ----------
+        fused_info : dict
+            Metadata for the combined COO subjacs.
+        """
+        offsets = self._pool_offsets
+        if all(key in offsets for key in fused_info['keys']):
+            pool_map = np.concatenate([np.arange(offsets[key], offsets[key] + meta['value'].size)
+                                       for key, meta in zip(fused_info['keys'],
+                                                            fused_info['metas'])])
+            if fused_info['csc_val_map'] is not None:
+                pool_map = pool_map[fused_info['csc_val_map']]
+            fused_info['pool_map'] = pool_map
+
+    def set_complex_step_mode(self, active):
+        """
+        Turn on or off complex stepping mode.
+
+        When turned on, the value in each subjac is cast as complex, and when turned
+        off, they are returned to real values.
+
+        Parameters
+        ----------
+        active : bool
+            Complex mode flag; set to True prior to commencing complex step.
+        """
+        super().set_complex_step_mode(active)
+
+        # the casts above replaced the pooled values with copies, so pool them again
+        if self._value_pool is not None:
+            self._setup_value_pool(list(self._pool_offsets))
+
+    def _setup_csc(self, system, key, meta):
+        """
+        Create the CSC matrix and COO to CSC value map for a subjac in our COO format.
+
+        Parameters
+        ----------
+        system : System
+            System that is updating this jacobian.
+        key : (str, str)
+            Absolute name pair of the sub-Jacobian.
+        meta : dict
+            Metadata for the sub-Jacobian.
+        """
+        abs2meta = system._var_abs2meta
+        res_name, other_name = key
+        nrows = abs2meta['output'][res_name]['size']
+        if other_name in abs2meta['output']:
+            ncols = abs2meta['output'][other_name]['size']
+        else:
+            ncols = abs2meta['input'][other_name]['size']
+
+        meta['csc'], meta['csc_val_map'] = _build_csc(meta['rows'], meta['cols'],
+                                                      (nrows, ncols))
+
     def _apply(self, system, d_inputs, d_outputs, d_residuals, mode):
         """
         Compute matrix-vector product.
@@ -80,91 +260,852 @@ class DictionaryJacobian(Jacobian):
         mode : str
             'fwd' or 'rev'.
         """
-        # avoid circular import
-        from openmdao.core.explicitcomponent import ExplicitComponent
-
-        fwd = mode == 'fwd'
-        d_res_names = d_residuals._names
         d_out_names = d_outputs._names
         d_inp_names = d_inputs._names
 
         if not d_out_names and not d_inp_names:
             return
 
+        plan, plan_names, scoped_plans, threaded = self._get_apply_plan(system, d_inputs,
+                                                                        d_outputs, d_residuals)
+
+        if self._randomize:
+            # we need randomized subjacs, which are only available one at a time.
+            plan = _scoped_plan(plan, plan_names, d_out_names, d_inp_names, True)
+            threaded = False
+        elif d_inputs._in_matvec_context() or d_outputs._in_matvec_context():
+            # the vectors have been restricted to a scope for this matvec product.  The products
+            # for a given scope never change, so they're only resolved once.
+            key = (d_out_names, d_inp_names)
+            if key not in scoped_plans:
+                scoped_plans[key] = _scoped_plan(plan, plan_names, d_out_names, d_inp_names,
+                                                 False)
+            plan = scoped_plans[key]
+
+        with system._unscaled_context(outputs=[d_outputs], residuals=[d_residuals]):
+            if mode == 'fwd':
+                self._apply_fwd(plan, threaded)
+            else:
+                self._apply_rev(plan, threaded)
+
+    def _get_apply_plan(self, system, d_inputs, d_outputs, d_residuals):
+        """
+        Return the resolved subjac products for the given system and vectors.
+
+        The vectors and the kind of product for each subjac are resolved once and cached so
+        that the product loops don't need to do any name lookups or type checks.
+
+        Parameters
+        ----------
+        system : System
+            System that is updating this jacobian.
+        d_inputs : Vector
+            inputs linear vector.
+        d_outputs : Vector
+            outputs linear vector.
+        d_residuals : Vector
+            residuals linear vector.
+
+        Returns
+        -------
+        list of tuples
+            (kind, res_vec, other_vec, subjac_info, abs_key) for each subjac.
+        list of tuples
+            (other_name, is_output) for each subjac.
+        dict
+            Cache of the products restricted to each scope, keyed by the names in scope.
+        bool
+            True if the plan has matrix subjacs large enough to be multiplied in threads.
+        """
+        # views returned by _abs_get_val differ when under complex step
+        entry = (system.pathname, d_residuals._name, d_residuals._under_complex_step)
+
+        if entry in self._apply_plans:
+            vecs, plan, plan_names, scoped_plans, threaded = self._apply_plans[entry]
+            if vecs[0] is d_inputs and vecs[1] is d_outputs and vecs[2] is d_residuals:
+                return plan, plan_names, scoped_plans, threaded
+
+        # avoid circular import
+        from openmdao.core.component import Component
+
+        if self._value_pool is None and isinstance(system, Component):
+            # the pool is normally set up on the first linearize, which a component having
+            # neither compute_partials nor approximated partials never gets to
+            self._setup_value_pool(list(self._subjacs_info))
+
         rflat = d_residuals._abs_get_val
         oflat = d_outputs._abs_get_val
         iflat = d_inputs._abs_get_val
-        ncol = d_residuals._ncol
+        out_names = d_outputs._views
         subjacs_info = self._subjacs_info
-        is_explicit = isinstance(system, ExplicitComponent)
 
-        with system._unscaled_context(outputs=[d_outputs], residuals=[d_residuals]):
-            for abs_key in self._iter_abs_keys(system, d_residuals._name):
-                res_name, other_name = abs_key
-                if res_name in d_res_names:
-                    if other_name in d_out_names:
-                        # skip the matvec mult completely for identity subjacs
-                        if is_explicit and res_name is other_name:
-                            if fwd:
-                                val = rflat(res_name)
-                                val -= oflat(other_name)
-                            else:
-                                val = oflat(other_name)
-                                val -= rflat(res_name)
-                            continue
-                        if fwd:
-                            left_vec = rflat(res_name)
-                            right_vec = oflat(other_name)
-                        else:
-                            left_vec = oflat(other_name)
-                            right_vec = rflat(res_name)
-                    elif other_name in d_inp_names:
-                        if fwd:
-                            left_vec = rflat(res_name)
-                            right_vec = iflat(other_name)
-                        else:
-                            left_vec = iflat(other_name)
-                            right_vec = rflat(res_name)
-                    else:
-                        continue
-
-                    subjac_info = subjacs_info[abs_key]
-                    if self._randomize:
-                        subjac = self._randomize_subjac(subjac_info['value'], abs_key)
-                    else:
-                        subjac = subjac_info['value']
-                    rows = subjac_info['rows']
-                    if rows is not None:  # our homegrown COO format
-                        linds, rinds = rows, subjac_info['cols']
-                        if not fwd:
-                            linds, rinds = rinds, linds
-                        if self._under_complex_step:
-                            # bincount only works with float, so split into parts
-                            if ncol > 1:
-                                for i in range(ncol):
-                                    prod = right_vec[:, i][rinds] * subjac
-                                    left_vec[:, i].real += np.bincount(linds, prod.real,
-                                                                       minlength=left_vec.shape[0])
-                                    left_vec[:, i].imag += np.bincount(linds, prod.imag,
-                                                                       minlength=left_vec.shape[0])
-                            else:
-                                prod = right_vec[rinds] * subjac
-                                left_vec[:].real += np.bincount(linds, prod.real,
-                                                                minlength=left_vec.size)
-                                left_vec[:].imag += np.bincount(linds, prod.imag,
-                                                                minlength=left_vec.size)
-                        else:
-                            if ncol > 1:
-                                for i in range(ncol):
-                                    left_vec[:, i] += np.bincount(linds,
-                                                                  right_vec[:, i][rinds] * subjac,
-                                                                  minlength=left_vec.shape[0])
-                            else:
-                                left_vec[:] += np.bincount(linds, right_vec[rinds] * subjac,
-                                                           minlength=left_vec.size)
-
-                    else:
-                        if not fwd:
-                            subjac = subjac.transpose()
-
-                        left_vec += subjac.dot(right_vec)
+        plan = []
+        plan_names = []
+        identity = []
+        coo = {True: [], False: []}
+        dense = defaultdict(list)
+        for abs_key in self._iter_abs_keys(system, d_residuals._name):
+            res_name, other_name = abs_key
+            is_output = other_name in out_names
+            if is_output:
+                other_vec = oflat(other_name)
+                if subjacs_info[abs_key].get('is_explicit_identity', False):
+                    # skip the matvec mult completely for identity subjacs
+                    kind = _IDENTITY
+                else:
+                    kind = _MATRIX if subjacs_info[abs_key]['rows'] is None else _COO
+            else:
+                other_vec = iflat(other_name)
+                kind = _MATRIX if subjacs_info[abs_key]['rows'] is None else _COO
+
+            item = (kind, rflat(res_name), other_vec, subjacs_info[abs_key], abs_key)
+            if kind == _IDENTITY:
+                identity.append(item)
+            elif kind == _COO:
+                coo[is_output].append(item)
+            elif _is_batchable(item):
+                dense[is_output, item[3]['value'].shape].append(item)
+            else:
+                plan.append(item)
+                plan_names.append((other_name, is_output))
+
+        # residuals and outputs have the same layout, so identity subjacs of adjacent variables
+        # can be combined into a single subtraction over one slice of the data arrays
+        if identity:
+            offsets, _ = _get_offsets(d_outputs)
+            res_data = d_residuals._get_data()
+            out_data = d_outputs._get_data()
+            for run in _contiguous_runs(identity, offsets):
+                if len(run) > 1:
+                    start = offsets[run[0][4][1]]
+                    end = start + sum(item[2].shape[0] for item in run)
+                    names = [item[4][1] for item in run]
+                    plan.append((_IDENTITY, res_data[start:end], out_data[start:end],
+                                 {'plan': run, 'plan_names': [(n, True) for n in names]}, None))
+                    plan_names.append((frozenset(names), True))
+                else:
+                    plan.append(run[0])
+                    plan_names.append((run[0][4][1], True))
+
+        # multiply small dense subjacs having the same shape in batches using a single matmul
+        for (is_output, _), items in dense.items():
+            other = d_outputs if is_output else d_inputs
+            for batch in _dense_batches(items):
+                if len(batch) > 1:
+                    batch_info = _batch_dense(batch, d_residuals, other, is_output)
+                    plan.append((_BATCHED_DENSE, d_residuals._get_data(), other._get_data(),
+                                 batch_info, None))
+                    plan_names.append((batch_info['other_names'], is_output))
+                else:
+                    # a small dense subjac is just a COO subjac with every entry present, so
+                    # it can be multiplied along with the COO subjacs in the compiled kernel
+                    coo[is_output].append(batch[0])
+
+        # combine all COO subjacs wrt the same vector into a single CSC matrix so that only one
+        # matvec product is needed for all of them
+        fused = []
+        for is_output, other in ((True, d_outputs), (False, d_inputs)):
+            items = coo[is_output]
+            if len(items) > 1:
+                fused_info = _fuse_coo(items, d_residuals, [(other, is_output)])
+                self._map_to_pool(fused_info)
+                fused.append(((_FUSED_COO, d_residuals._get_data(), other._get_data(),
+                               fused_info, None), (fused_info['other_names'], is_output)))
+            else:
+                fused.extend((item, (item[4][1], is_output)) for item in items)
+
+        if coo[True] and coo[False] and len(fused) > 1:
+            # combine the products wrt outputs and inputs as well, using a single CSC matrix
+            # that multiplies the concatenated output and input data
+            fused_info = _fuse_coo(coo[True] + coo[False], d_residuals,
+                                   [(d_outputs, True), (d_inputs, False)])
+            self._map_to_pool(fused_info)
+            # if either vector is partially out of scope, use the separate products instead
+            fused_info['plan'] = [item for item, _ in fused]
+            fused_info['plan_names'] = [names for _, names in fused]
+            plan.append((_FUSED_COO_STATE, d_residuals._get_data(), None, fused_info, None))
+            plan_names.append((fused_info['other_names'], None))
+        else:
+            for item, names in fused:
+                plan.append(item)
+                plan_names.append(names)
+
+        # only plans having large matrix subjacs are worth splitting up between threads
+        threaded = _NUM_THREADS > 1 and any(item[0] == _MATRIX and
+                                            _nnz(item[3]['value']) >= _MIN_THREADED_SIZE
+                                            for item in plan)
+
+        scoped_plans = {}
+        self._apply_plans[entry] = ((d_inputs, d_outputs, d_residuals), plan, plan_names,
+                                    scoped_plans, threaded)
+
+        return plan, plan_names, scoped_plans, threaded
+
+    def _acquire(self, shape, dtype, zero=True):
+        """
+        Return a scratch array from the pool, allocating it if none are free.
+
+        Parameters
+        ----------
+        shape : tuple
+            Shape of the array.
+        dtype : dtype
+            Data type of the array.
+        zero : bool
+            If True, zero the array.  Otherwise its contents are undefined.
+
+        Returns
+        -------
+        ndarray
+            The scratch array.  It should be returned to the pool using _release.
+        """
+        free = self._scratch_pool.get((shape, dtype))
+        if free:
+            arr = free.pop()
+            if zero:
+                arr[:] = 0.0
+            return arr
+        return np.zeros(shape, dtype=dtype) if zero else np.empty(shape, dtype=dtype)
+
+    def _release(self, arr):
+        """
+        Return a scratch array to the pool so it can be reused.
+
+        Parameters
+        ----------
+        arr : ndarray
+            Array previously returned by _acquire.
+        """
+        self._scratch_pool.setdefault((arr.shape, arr.dtype), []).append(arr)
+
+    def _get_subjac(self, subjac_info, abs_key):
+        """
+        Return the value of the given subjac, randomized if we're computing sparsity.
+
+        Parameters
+        ----------
+        subjac_info : dict
+            Metadata for the sub-Jacobian.
+        abs_key : (str, str)
+            Absolute name pair of the sub-Jacobian.
+
+        Returns
+        -------
+        ndarray or spmatrix
+            The sub-Jacobian value.
+        """
+        if self._randomize:
+            return self._randomize_subjac(subjac_info['value'], abs_key)
+        return subjac_info['value']
+
+    def _apply_fwd(self, plan, threaded=False):
+        """
+        Compute the forward matrix-vector product for each subjac in the plan.
+
+        Parameters
+        ----------
+        plan : list of tuples
+            (kind, res_vec, other_vec, subjac_info, abs_key) for each subjac.
+        threaded : bool
+            If True, multiply the large matrix subjacs in the plan using the thread pool.
+        """
+        if threaded:
+            plan = _apply_threaded(plan, _fwd_matrix_products, 0)
+
+        get_subjac = self._get_subjac
+        for kind, res_vec, other_vec, subjac_info, abs_key in plan:
+            if kind == _IDENTITY:
+                res_vec -= other_vec
+            elif kind == _COO:
+                _update_csc(subjac_info, get_subjac(subjac_info, abs_key))
+                _csc_matvec(subjac_info, other_vec, res_vec)
+            elif kind == _FUSED_COO:
+                _update_fused_csc(subjac_info, self._value_pool)
+                _csc_matvec(subjac_info, other_vec, res_vec)
+            elif kind == _FUSED_COO_STATE:
+                _update_fused_csc(subjac_info, self._value_pool)
+                # the state is overwritten by the concatenation, so it doesn't need zeroing
+                state = self._acquire(subjac_info['state_shape'], subjac_info['state_dtype'],
+                                      zero=False)
+                np.concatenate(subjac_info['other_data'], out=state)
+                _csc_matvec(subjac_info, state, res_vec)
+                self._release(state)
+            elif kind == _BATCHED_DENSE:
+                n, m, k = subjac_info['shape']
+                x = other_vec[subjac_info['other_idxs']].reshape(n, k, -1)
+                prod = np.matmul(_stack_dense(subjac_info), x)
+                res_vec[subjac_info['res_idxs']] += prod.reshape((n * m,) + res_vec.shape[1:])
+            else:  # ndarray or sparse
+                res_vec += get_subjac(subjac_info, abs_key).dot(other_vec)
+
+    def _apply_rev(self, plan, threaded=False):
+        """
+        Compute the reverse (transpose) matrix-vector product for each subjac in the plan.
+
+        Parameters
+        ----------
+        plan : list of tuples
+            (kind, res_vec, other_vec, subjac_info, abs_key) for each subjac.
+        threaded : bool
+            If True, multiply the large matrix subjacs in the plan using the thread pool.
+        """
+        if threaded:
+            plan = _apply_threaded(plan, _rev_matrix_products, 1)
+
+        get_subjac = self._get_subjac
+        for kind, res_vec, other_vec, subjac_info, abs_key in plan:
+            if kind == _IDENTITY:
+                other_vec -= res_vec
+            elif kind == _COO:
+                _update_csc(subjac_info, get_subjac(subjac_info, abs_key))
+                _csc_rmatvec(subjac_info, res_vec, other_vec)
+            elif kind == _FUSED_COO:
+                _update_fused_csc(subjac_info, self._value_pool)
+                _csc_rmatvec(subjac_info, res_vec, other_vec)
+            elif kind == _FUSED_COO_STATE:
+                _update_fused_csc(subjac_info, self._value_pool)
+                state = self._acquire(subjac_info['state_shape'], subjac_info['state_dtype'])
+                _csc_rmatvec(subjac_info, res_vec, state)
+                out_data, in_data = subjac_info['other_data']
+                out_data += state[:out_data.shape[0]]
+                in_data += state[out_data.shape[0]:]
+                self._release(state)
+            elif kind == _BATCHED_DENSE:
+                n, m, k = subjac_info['shape']
+                x = res_vec[subjac_info['res_idxs']].reshape(n, m, -1)
+                prod = np.matmul(_stack_dense(subjac_info).transpose(0, 2, 1), x)
+                other_vec[subjac_info['other_idxs']] += prod.reshape((n * k,) + other_vec.shape[1:])
+            else:  # ndarray or sparse
+                other_vec += get_subjac(subjac_info, abs_key).transpose().dot(res_vec)
+
+
+def _apply_threaded(plan, func, target):
+    """
+    Compute the products for large matrix subjacs in the plan using the thread pool.
+
+    Products that update the same variable are computed in the same thread, so no two threads
+    ever write to the same array.  All threads are finished when this returns.
+
+    Parameters
+    ----------
+    plan : list of tuples
+        (kind, res_vec, other_vec, subjac_info, abs_key) for each subjac.
+    func : function
+        Function that computes the products for a list of plan items.
+    target : int
+        Index in abs_key of the variable that each product updates.
+
+    Returns
+    -------
+    list of tuples
+        The remaining products in the plan, which must be computed afterwards.
+    """
+    global _thread_pool, _thread_pool_size
+
+    groups = defaultdict(list)
+    rest = []
+    for item in plan:
+        if item[0] == _MATRIX and _nnz(item[3]['value']) >= _MIN_THREADED_SIZE:
+            groups[item[4][target]].append(item)
+        else:
+            rest.append(item)
+
+    if len(groups) > 1:
+        if _thread_pool is None or _thread_pool_size != _NUM_THREADS:
+            # create the pool, or replace it if the number of threads has changed
+            if _thread_pool is not None:
+                _thread_pool.shutdown()
+            _thread_pool = ThreadPoolExecutor(max_workers=_NUM_THREADS)
+            _thread_pool_size = _NUM_THREADS
+        for future in [_thread_pool.submit(func, items) for items in groups.values()]:
+            future.result()
+        return rest
+
+    return plan
+
+
+def _nnz(value):
+    """
+    Return the number of stored entries in the given subjac value.
+
+    Parameters
+    ----------
+    value : ndarray or spmatrix
+        The subjac value.
+
+    Returns
+    -------
+    int
+        Number of stored entries.
+    """
+    return value.size if isinstance(value, np.ndarray) else value.nnz
+
+
+def _fwd_matrix_products(items):
+    """
+    Compute the forward products for the given matrix subjacs.
+
+    Parameters
+    ----------
+    items : list of tuples
+        (kind, res_vec, other_vec, subjac_info, abs_key) for each subjac.
+    """
+    for _, res_vec, other_vec, subjac_info, _ in items:
+        res_vec += subjac_info['value'].dot(other_vec)
+
+
+def _rev_matrix_products(items):
+    """
+    Compute the reverse products for the given matrix subjacs.
+
+    Parameters
+    ----------
+    items : list of tuples
+        (kind, res_vec, other_vec, subjac_info, abs_key) for each subjac.
+    """
+    for _, res_vec, other_vec, subjac_info, _ in items:
+        other_vec += subjac_info['value'].transpose().dot(res_vec)
+
+
+def _can_use_kernel(data, x, y):
+    """
+    Return True if the sparsetools kernels can be called directly for the given arrays.
+
+    The kernels require contiguous arrays of the same dtype, so anything else (e.g., the real
+    part of a complex vector) goes through the scipy matrix interface instead.
+
+    Parameters
+    ----------
+    data : ndarray
+        Data array of the CSC matrix.
+    x : ndarray
+        Array being multiplied.
+    y : ndarray
+        Array that the product is added to.
+
+    Returns
+    -------
+    bool
+        True if the kernels can be called directly.
+    """
+    return (csc_matvec is not None and x.dtype == data.dtype and y.dtype == data.dtype and
+            x.flags.c_contiguous and y.flags.c_contiguous)
+
+
+def _csc_matvec(info, x, y):
+    """
+    Add the product of the CSC matrix in the given metadata and x to y in place.
+
+    Parameters
+    ----------
+    info : dict
+        Metadata containing the CSC matrix.
+    x : ndarray
+        Array being multiplied.
+    y : ndarray
+        Array that the product is added to.
+    """
+    csc = info['csc']
+    if _can_use_kernel(csc.data, x, y):
+        nrows, ncols = csc.shape
+        if x.ndim == 1:
+            csc_matvec(nrows, ncols, csc.indptr, csc.indices, csc.data, x, y)
+        else:
+            csc_matvecs(nrows, ncols, x.shape[1], csc.indptr, csc.indices, csc.data,
+                        x.ravel(), y.ravel())
+    else:
+        y += csc.dot(x)
+
+
+def _csc_rmatvec(info, x, y):
+    """
+    Add the product of the transpose of the CSC matrix in the given metadata and x to y in place.
+
+    Parameters
+    ----------
+    info : dict
+        Metadata containing the CSC matrix.
+    x : ndarray
+        Array being multiplied.
+    y : ndarray
+        Array that the product is added to.
+    """
+    csc = info['csc']
+    # the CSC arrays of a matrix are the CSR arrays of its transpose, so the transposed
+    # product walks the major axis just like the forward product does.
+    if _can_use_kernel(csc.data, x, y):
+        nrows, ncols = csc.shape
+        if x.ndim == 1:
+            csr_matvec(ncols, nrows, csc.indptr, csc.indices, csc.data, x, y)
+        else:
+            csr_matvecs(ncols, nrows, x.shape[1], csc.indptr, csc.indices, csc.data,
+                        x.ravel(), y.ravel())
+    else:
+        if 'csr_T' not in info:
+            # the transpose shares the index and data arrays of the CSC matrix
+            info['csr_T'] = csc.transpose()
+        csr_T = info['csr_T']
+        csr_T.data = csc.data
+        y += csr_T.dot(x)
+
+
+def _update_csc(subjac_info, subjac):
+    """
+    Copy the given COO subjac values into the cached CSC matrix for that subjac.
+
+    Parameters
+    ----------
+    subjac_info : dict
+        Metadata for the sub-Jacobian.
+    subjac : ndarray
+        Values of the sub-Jacobian in our COO ordering.
+    """
+    csc = subjac_info['csc']
+    inds = subjac_info['csc_val_map']
+    if inds is None:
+        # COO ordering already matches CSC ordering, so no copy is needed
+        csc.data = subjac
+    else:
+        if csc.data.dtype != subjac.dtype:
+            csc.data = np.empty(subjac.size, dtype=subjac.dtype)
+        np.take(subjac, inds, out=csc.data)
+
+
+def _update_fused_csc(fused_info, pool):
+    """
+    Copy the current values of all of the fused COO subjacs into their combined CSC matrix.
+
+    Parameters
+    ----------
+    fused_info : dict
+        Metadata for the combined COO subjacs.
+    pool : ndarray or None
+        Contiguous array holding the subjac values, if any.
+    """
+    metas = fused_info['metas']
+    if 'pool_map' in fused_info and all(meta['value'].base is pool for meta in metas):
+        # gather the values straight from the pool in CSC order
+        csc = fused_info['csc']
+        if csc.data.dtype != pool.dtype:
+            csc.data = np.empty(csc.data.size, dtype=pool.dtype)
+        np.take(pool, fused_info['pool_map'], out=csc.data)
+    else:
+        # a subjac value has been replaced rather than set in place
+        _update_csc(fused_info, np.concatenate([meta['value'] for meta in metas], axis=None))
+
+
+def _build_csc(rows, cols, shape):
+    """
+    Create a CSC matrix having the given COO sparsity, along with a COO to CSC value map.
+
+    Parameters
+    ----------
+    rows : ndarray
+        Row indices of the COO entries.
+    cols : ndarray
+        Column indices of the COO entries.
+    shape : tuple
+        Shape of the matrix.
+
+    Returns
+    -------
+    csc_matrix
+        CSC matrix with zero data.
+    ndarray or None
+        Index array mapping CSC data positions to COO positions, or None if they are the same.
+    """
+    nrows, ncols = shape
+
+    # sort by column, then by row.  Entries are unique, so an unstable sort of the combined
+    # key gives the same order as a stable one.
+    order = np.argsort(cols.astype(np.int64) * nrows + rows, kind='quicksort')
+
+    # use 32 bit indices when possible to halve the memory traffic of the matvec kernels
+    idx_dtype = np.int32 if max(rows.size, nrows, ncols) < 2 ** 31 else np.int64
+    indptr = np.zeros(ncols + 1, dtype=idx_dtype)
+    np.cumsum(np.bincount(cols, minlength=ncols), out=indptr[1:])
+
+    csc = csc_matrix((np.zeros(rows.size), rows[order].astype(idx_dtype), indptr), shape=shape)
+    if np.all(order == np.arange(order.size)):
+        return csc, None
+    return csc, np.ascontiguousarray(order, dtype=np.intp)
+
+
+def _get_offsets(vec):
+    """
+    Return the starting index of each variable in the local data array of the given vector.
+
+    Parameters
+    ----------
+    vec : Vector
+        The vector.
+
+    Returns
+    -------
+    dict
+        Mapping of absolute var name to starting index.
+    int
+        Size of the local data array.
+    """
+    offsets = {}
+    start = 0
+    views_flat = vec._views_flat
+    for name in vec._system()._var_relevant_names[vec._name][vec._typ]:
+        offsets[name] = start
+        start += views_flat[name].shape[0]
+    return offsets, start
+
+
+def _fuse_coo(items, d_residuals, others):
+    """
+    Combine the given COO subjac products into a single product over the full vectors.
+
+    Parameters
+    ----------
+    items : list of tuples
+        (kind, res_vec, other_vec, subjac_info, abs_key) for each COO or small dense subjac.
+    d_residuals : Vector
+        residuals linear vector.
+    others : list of (Vector, bool)
+        The outputs and/or inputs linear vectors that the subjacs are taken with respect to,
+        and whether each one is the outputs vector.  If there is more than one, their data
+        arrays are concatenated into a state array that the combined matrix multiplies.
+
+    Returns
+    -------
+    dict
+        Metadata for the combined COO subjacs.
+    """
+    roffsets, nrows = _get_offsets(d_residuals)
+
+    coffsets = {}
+    is_output = {}
+    ncols = 0
+    for other, other_is_output in others:
+        offsets, size = _get_offsets(other)
+        for name, offset in offsets.items():
+            coffsets[name] = offset + ncols
+            is_output[name] = other_is_output
+        ncols += size
+
+    rows = []
+    cols = []
+    for _, _, _, meta, (res_name, other_name) in items:
+        if meta['rows'] is None:  # small dense subjac, stored in row major order
+            m, k = meta['value'].shape
+            rows.append(np.repeat(np.arange(m), k) + roffsets[res_name])
+            cols.append(np.tile(np.arange(k), m) + coffsets[other_name])
+        else:
+            rows.append(meta['rows'] + roffsets[res_name])
+            cols.append(meta['cols'] + coffsets[other_name])
+
+    csc, val_map = _build_csc(np.concatenate(rows), np.concatenate(cols), (nrows, ncols))
+
+    fused_info = {
+        'csc': csc,
+        'csc_val_map': val_map,
+        'metas': [item[3] for item in items],
+        'keys': [item[4] for item in items],
+        'other_names': frozenset(item[4][1] for item in items),
+        'plan': items,
+        'plan_names': [(item[4][1], is_output[item[4][1]]) for item in items],
+    }
+
+    if len(others) > 1:
+        other_data = [other._get_data() for other, _ in others]
+        fused_info['other_data'] = other_data
+        fused_info['state_shape'] = (ncols,) + other_data[0].shape[1:]
+        fused_info['state_dtype'] = other_data[0].dtype
+
+    return fused_info
+
+
+def _is_batchable(item):
+    """
+    Return True if the given product is for a small dense subjac.
+
+    Parameters
+    ----------
+    item : tuple
+        (kind, res_vec, other_vec, subjac_info, abs_key) for the product.
+
+    Returns
+    -------
+    bool
+        True if the subjac can be multiplied in a batch with others of the same shape.
+    """
+    _, res_vec, other_vec, subjac_info, _ = item
+    value = subjac_info['value']
+    return (isinstance(value, np.ndarray) and value.size <= _MAX_BATCHED_SIZE and
+            value.shape == (res_vec.shape[0], other_vec.shape[0]))
+
+
+def _dense_batches(items):
+    """
+    Split the given dense subjac products into batches that can be multiplied together.
+
+    The results of a batch are scattered into the residuals (fwd) or the other vector (rev)
+    using fancy indexing, so no variable may appear more than once in a batch.
+
+    Parameters
+    ----------
+    items : list of tuples
+        (kind, res_vec, other_vec, subjac_info, abs_key) for each product.
+
+    Returns
+    -------
+    list of lists
+        Batches of products.
+    """
+    batches = []
+    for item in items:
+        res_name, other_name = item[4]
+        for batch, names in batches:
+            if res_name not in names[0] and other_name not in names[1]:
+                break
+        else:
+            batch, names = [], (set(), set())
+            batches.append((batch, names))
+        batch.append(item)
+        names[0].add(res_name)
+        names[1].add(other_name)
+    return [batch for batch, _ in batches]
+
+
+def _batch_dense(items, d_residuals, other, is_output):
+    """
+    Combine the given same-shape dense subjac products into a single batched product.
+
+    Parameters
+    ----------
+    items : list of tuples
+        (kind, res_vec, other_vec, subjac_info, abs_key) for each dense subjac.
+    d_residuals : Vector
+        residuals linear vector.
+    other : Vector
+        The outputs or inputs linear vector that all of the subjacs are taken with respect to.
+    is_output : bool
+        True if other is the outputs vector.
+
+    Returns
+    -------
+    dict
+        Metadata for the batched dense subjacs.
+    """
+    roffsets, _ = _get_offsets(d_residuals)
+    coffsets, _ = _get_offsets(other)
+    m, k = items[0][3]['value'].shape
+
+    res_idxs = []
+    other_idxs = []
+    for _, _, _, _, (res_name, other_name) in items:
+        res_idxs.append(np.arange(roffsets[res_name], roffsets[res_name] + m))
+        other_idxs.append(np.arange(coffsets[other_name], coffsets[other_name] + k))
+
+    return {
+        'shape': (len(items), m, k),
+        'res_idxs': np.concatenate(res_idxs),
+        'other_idxs': np.concatenate(other_idxs),
+        'metas': [item[3] for item in items],
+        'other_names': frozenset(item[4][1] for item in items),
+        'plan': items,
+        'plan_names': [(item[4][1], is_output) for item in items],
+        'stacked': None,
+    }
+
+
+def _stack_dense(batch_info):
+    """
+    Copy the current values of all of the batched dense subjacs into one 3-D array.
+
+    Parameters
+    ----------
+    batch_info : dict
+        Metadata for the batched dense subjacs.
+
+    Returns
+    -------
+    ndarray
+        Array of shape (nsubjacs, nrows, ncols) containing the subjac values.
+    """
+    values = [meta['value'] for meta in batch_info['metas']]
+    stacked = batch_info['stacked']
+    if stacked is None or stacked.dtype != values[0].dtype:
+        batch_info['stacked'] = stacked = np.empty(batch_info['shape'], dtype=values[0].dtype)
+    return np.stack(values, out=stacked)
+
+
+def _contiguous_runs(items, offsets):
+    """
+    Split the given products into runs whose other variables are adjacent in memory.
+
+    Parameters
+    ----------
+    items : list of tuples
+        (kind, res_vec, other_vec, subjac_info, abs_key) for each product.
+    offsets : dict
+        Mapping of absolute var name to starting index in the local data array.
+
+    Returns
+    -------
+    list of lists
+        Runs of products, in order of increasing offset.
+    """
+    runs = []
+    end = None
+    for item in sorted(items, key=lambda item: offsets[item[4][1]]):
+        start = offsets[item[4][1]]
+        if start == end:
+            runs[-1].append(item)
+        else:
+            runs.append([item])
+        end = start + item[2].shape[0]
+    return runs
+
+
+def _scoped_plan(plan, plan_names, d_out_names, d_inp_names, split_fused):
+    """
+    Return the part of the plan that's relevant to the current matvec scope.
+
+    Combined products are kept only if all of their subjacs are in scope.  Otherwise they are
+    replaced by the products that they combine, restricted to the scope in the same way.
+
+    Parameters
+    ----------
+    plan : list of tuples
+        (kind, res_vec, other_vec, subjac_info, abs_key) for each product.
+    plan_names : list of tuples
+        (other_name, is_output) for each product.  other_name is a frozenset of names for
+        combined products, and is_output is None for products wrt both outputs and inputs.
+    d_out_names : frozenset
+        Names of outputs in scope.
+    d_inp_names : frozenset
+        Names of inputs in scope.
+    split_fused : bool
+        If True, always replace combined products that use subjac values with the individual
+        subjac products.
+
+    Returns
+    -------
+    list of tuples
+        (kind, res_vec, other_vec, subjac_info, abs_key) for each product in scope.
+    """
+    scoped = []
+    for item, (other_name, is_output) in zip(plan, plan_names):
+        if isinstance(other_name, frozenset):  # a combined product
+            if split_fused and item[0] != _IDENTITY:
+                in_scope = False
+            elif is_output is None:  # product wrt both outputs and inputs
+                # input and output names never overlap, so check each name against both
+                in_scope = all(n in d_out_names or n in d_inp_names for n in other_name)
+            else:
+                in_scope = other_name.issubset(d_out_names if is_output else d_inp_names)
+
+            if in_scope:
+                scoped.append(item)
+            else:
+                scoped.extend(_scoped_plan(item[3]['plan'], item[3]['plan_names'],
+                                           d_out_names, d_inp_names, split_fused))
+        elif other_name in (d_out_names if is_output else d_inp_names):
+            scoped.append(item)
+    return scoped
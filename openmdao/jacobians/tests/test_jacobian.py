@@ -3,6 +3,7 @@
 import itertools
 import sys
 import unittest
+from unittest import mock
 
 import numpy as np
 from scipy.sparse import coo_matrix, csr_matrix
@@ -10,8 +11,10 @@ from scipy.sparse import coo_matrix, csr_matrix
 from openmdao.api import IndepVarComp, Group, Problem, \
                          ExplicitComponent, ImplicitComponent, ExecComp, \
                          NewtonSolver, ScipyKrylov, \
-                         LinearBlockGS, DirectSolver
-from openmdao.utils.assert_utils import assert_near_equal
+                         LinearBlockGS, DirectSolver, MetaModelUnStructuredComp, ResponseSurface
+import openmdao.jacobians.dictionary_jacobian as dictionary_jacobian
+from openmdao.jacobians.dictionary_jacobian import _get_num_threads
+from openmdao.utils.assert_utils import assert_near_equal, assert_warning
 from openmdao.test_suite.components.paraboloid import Paraboloid
 from openmdao.api import ScipyOptimizeDriver
 
@@ -1060,6 +1063,309 @@ class OverlappingPartialsTestCase(unittest.TestCase):
                                                  [ 5.,  10.,  0., -1.]]))
 
 
+class UnorderedCOOComp(ExplicitComponent):
+    """Declares sparse partials that are not in CSC order."""
+
+    def setup(self):
+        self.add_input('x', val=np.ones(3))
+        self.add_output('y', val=np.zeros(3))
+
+        self.declare_partials('y', 'x', rows=[2, 0, 1, 2], cols=[2, 1, 0, 0])
+
+    def compute(self, inputs, outputs):
+        x = inputs['x']
+        outputs['y'] = np.array([5.0 * x[1], 3.0 * x[0], 2.0 * x[2] + 7.0 * x[0]])
+
+    def compute_partials(self, inputs, partials):
+        partials['y', 'x'] = np.array([2.0, 5.0, 3.0, 7.0])
+
+
+class MultiCOOComp(ImplicitComponent):
+    """Has several sparse partials wrt both inputs and outputs."""
+
+    def setup(self):
+        self.add_input('a', val=np.ones(3))
+        self.add_input('b', val=np.ones(2))
+        self.add_output('x', val=np.ones(3))
+        self.add_output('y', val=np.ones(2))
+
+        self.declare_partials('x', 'a', rows=[0, 1, 2], cols=[2, 1, 0], val=[1., 2., 3.])
+        self.declare_partials('x', 'x', rows=[0, 1, 2, 2], cols=[0, 1, 2, 0],
+                              val=[-4., -5., -6., 1.])
+        self.declare_partials('y', 'b', rows=[1, 0], cols=[0, 1], val=[7., 8.])
+        self.declare_partials('y', 'x', rows=[0, 1], cols=[2, 0], val=[9., 10.])
+        self.declare_partials('y', 'y', rows=[0, 1], cols=[0, 1], val=[-2., -3.])
+
+    def apply_nonlinear(self, inputs, outputs, residuals):
+        a = inputs['a']
+        b = inputs['b']
+        x = outputs['x']
+        y = outputs['y']
+        residuals['x'] = np.array([a[2] - 4. * x[0], 2. * a[1] - 5. * x[1],
+                                   3. * a[0] - 6. * x[2] + x[0]])
+        residuals['y'] = np.array([8. * b[1] + 9. * x[2] - 2. * y[0],
+                                   7. * b[0] + 10. * x[0] - 3. * y[1]])
+
+
+class DenseMatComp(ExplicitComponent):
+    """Computes y = A.a + B.b and z = C.a using dense partials."""
+
+    def setup(self):
+        rng = np.random.RandomState(11)
+        # too large to be batched or combined with other subjacs
+        self.A, self.B, self.C = rng.random_sample((3, 20, 20))
+
+        self.add_input('a', val=np.ones(20))
+        self.add_input('b', val=np.ones(20))
+        self.add_output('y', val=np.ones(20))
+        self.add_output('z', val=np.ones(20))
+
+        self.declare_partials('y', 'a', val=self.A)
+        self.declare_partials('y', 'b', val=self.B)
+        self.declare_partials('z', 'a', val=self.C)
+
+    def compute(self, inputs, outputs):
+        outputs['y'] = self.A.dot(inputs['a']) + self.B.dot(inputs['b'])
+        outputs['z'] = self.C.dot(inputs['a'])
+
+
+class DictionaryJacobianApplyTestCase(unittest.TestCase):
+
+    @parameterized.expand(itertools.product(['fwd', 'rev'], [False, True]))
+    def test_unordered_rows_cols(self, mode, alloc_complex):
+        p = Problem()
+        p.model.add_subsystem('indeps', IndepVarComp('x', np.ones(3)))
+        p.model.add_subsystem('C1', UnorderedCOOComp())
+        p.model.connect('indeps.x', 'C1.x')
+        if alloc_complex:
+            # linear vectors are complex when a solver needs derivatives under complex step
+            p.model.nonlinear_solver = NewtonSolver(solve_subsystems=False)
+            p.model.nonlinear_solver.linear_solver = DirectSolver()
+        p.setup(mode=mode, force_alloc_complex=alloc_complex)
+        p.run_model()
+
+        J = p.compute_totals(of=['C1.y'], wrt=['indeps.x'], return_format='array')
+        np.testing.assert_almost_equal(J, np.array([[0., 5., 0.],
+                                                    [3., 0., 0.],
+                                                    [7., 0., 2.]]))
+
+    @parameterized.expand(['fwd', 'rev'])
+    def test_unordered_rows_cols_vectorized(self, mode):
+        p = Problem()
+        p.model.add_subsystem('indeps', IndepVarComp('x', np.ones(3)))
+        p.model.add_subsystem('C1', UnorderedCOOComp())
+        p.model.connect('indeps.x', 'C1.x')
+        p.model.add_design_var('indeps.x', vectorize_derivs=True)
+        p.model.add_constraint('C1.y', lower=0.0, vectorize_derivs=True)
+        p.setup(mode=mode)
+        p.run_model()
+
+        J = p.compute_totals(return_format='array')
+        np.testing.assert_almost_equal(J, np.array([[0., 5., 0.],
+                                                    [3., 0., 0.],
+                                                    [7., 0., 2.]]))
+
+    @parameterized.expand(['fwd', 'rev'])
+    def test_multiple_coo_subjacs(self, mode):
+        def build(linear_solver):
+            p = Problem()
+            model = p.model
+            model.add_subsystem('indeps', IndepVarComp('a', np.array([1., 2., 3.])))
+            # indeps.a is outside of the scope of sub's matvec products
+            sub = model.add_subsystem('sub', Group())
+            sub.add_subsystem('C1', MultiCOOComp())
+            sub.add_subsystem('C2', MultiCOOComp())
+            model.connect('indeps.a', 'sub.C1.a')
+            sub.connect('C1.y', 'C2.b')
+            sub.connect('C1.x', 'C2.a')
+            sub.connect('C2.y', 'C1.b')
+            sub.nonlinear_solver = NewtonSolver(solve_subsystems=False)
+            sub.nonlinear_solver.linear_solver = DirectSolver()
+            sub.linear_solver = linear_solver
+            p.setup(mode=mode)
+            p.run_model()
+            return p
+
+        p = build(ScipyKrylov(atol=1e-12, rtol=1e-12))
+        J = p.compute_totals(of=['sub.C2.x', 'sub.C2.y'], wrt=['indeps.a'],
+                             return_format='array')
+
+        expected = build(DirectSolver()).compute_totals(of=['sub.C2.x', 'sub.C2.y'],
+                                                        wrt=['indeps.a'],
+                                                        return_format='array')
+
+        assert_near_equal(J, expected, 1e-9)
+
+    @parameterized.expand(['fwd', 'rev'])
+    def test_explicit_multiple_outputs(self, mode):
+        p = Problem()
+        model = p.model
+        model.add_subsystem('indeps', IndepVarComp('x', np.array([1., 2., 3.])))
+        model.add_subsystem('C1', ExecComp(['y=2.0*x**2', 'z=3.0*x', 'w=x[1]'],
+                                           x=np.ones(3), y=np.ones(3), z=np.ones(3), w=1.0))
+        model.connect('indeps.x', 'C1.x')
+        model.linear_solver = ScipyKrylov(atol=1e-12, rtol=1e-12)
+        p.setup(mode=mode)
+        p.run_model()
+
+        J = p.compute_totals(of=['C1.y', 'C1.z', 'C1.w'], wrt=['indeps.x'],
+                             return_format='array')
+        np.testing.assert_almost_equal(J, np.vstack([np.diag([4., 8., 12.]),
+                                                     np.diag([3., 3., 3.]),
+                                                     [[0., 1., 0.]]]))
+
+    @parameterized.expand([('fwd', False), ('rev', False), ('fwd', True)])
+    def test_same_shape_dense_subjacs(self, mode, vectorize):
+        p = Problem()
+        model = p.model
+        indeps = model.add_subsystem('indeps', IndepVarComp())
+        indeps.add_output('a', np.array([1., 2.]))
+        indeps.add_output('b', np.array([3., 4.]))
+        indeps.add_output('c', np.array([5., 6.]))
+        model.add_subsystem('C1', ExecComp(['x=a[0]*a[1]', 'y=b[0]**2 + b[1]', 'z=c[0] - c[1]**2',
+                                            'w=a[0]*c[0]'],
+                                           a=np.ones(2), b=np.ones(2), c=np.ones(2)))
+        model.connect('indeps.a', 'C1.a')
+        model.connect('indeps.b', 'C1.b')
+        model.connect('indeps.c', 'C1.c')
+        model.add_design_var('indeps.a', vectorize_derivs=vectorize)
+        model.add_design_var('indeps.b', vectorize_derivs=vectorize)
+        model.add_design_var('indeps.c', vectorize_derivs=vectorize)
+        for out in ('x', 'y', 'z', 'w'):
+            model.add_constraint('C1.' + out, lower=0.0)
+        p.setup(mode=mode)
+        p.run_model()
+
+        J = p.compute_totals(return_format='array')
+        np.testing.assert_almost_equal(J, np.array([[2., 1., 0., 0., 0., 0.],
+                                                    [0., 0., 6., 1., 0., 0.],
+                                                    [0., 0., 0., 0., 1., -12.],
+                                                    [5., 0., 0., 0., 1., 0.]]))
+
+    @parameterized.expand(['fwd', 'rev'])
+    def test_threaded_matrix_subjacs(self, mode):
+        p = Problem()
+        model = p.model
+        indeps = model.add_subsystem('indeps', IndepVarComp())
+        indeps.add_output('a', np.ones(20))
+        indeps.add_output('b', np.ones(20))
+        comp = model.add_subsystem('C1', DenseMatComp())
+        model.connect('indeps.a', 'C1.a')
+        model.connect('indeps.b', 'C1.b')
+        model.linear_solver = ScipyKrylov(atol=1e-12, rtol=1e-12)
+
+        def shutdown_thread_pool():
+            if dictionary_jacobian._thread_pool is not None:
+                dictionary_jacobian._thread_pool.shutdown()
+            dictionary_jacobian._thread_pool = None
+            dictionary_jacobian._thread_pool_size = 0
+
+        self.addCleanup(shutdown_thread_pool)
+
+        with mock.patch.multiple('openmdao.jacobians.dictionary_jacobian', _NUM_THREADS=2,
+                                 _MIN_THREADED_SIZE=1):
+            p.setup(mode=mode)
+            p.run_model()
+            J = p.compute_totals(of=['C1.y', 'C1.z'], wrt=['indeps.a', 'indeps.b'],
+                                 return_format='array')
+
+        assert_near_equal(J, np.block([[comp.A, comp.B], [comp.C, np.zeros((20, 20))]]), 1e-10)
+
+        self.assertEqual(dictionary_jacobian._thread_pool_size, 2)
+
+        # only the plan having large matrix subjacs is split up between threads
+        self.assertTrue(all(entry[-1] for entry in comp._jacobian._apply_plans.values()))
+        for entry in model.indeps._jacobian._apply_plans.values():
+            self.assertFalse(entry[-1])
+
+    def test_bad_num_threads(self):
+        with mock.patch.dict('os.environ', {'OPENMDAO_JAC_THREADS': 'four'}):
+            with assert_warning(UserWarning, "OPENMDAO_JAC_THREADS should be a positive integer "
+                                "but is 'four', so subjac products will not be threaded."):
+                self.assertEqual(_get_num_threads(), 1)
+
+    def test_subjac_value_pool(self):
+        p = Problem()
+        model = p.model
+        model.add_subsystem('indeps', IndepVarComp('a', np.array([1., 2., 3.])))
+        comp = model.add_subsystem('C1', MultiCOOComp())
+        model.connect('indeps.a', 'C1.a')
+        model.linear_solver = DirectSolver()
+        p.setup(force_alloc_complex=True)
+        p.run_model()
+
+        # complex step replaces the subjac values, which must then be pooled again
+        p.check_partials(method='cs', out_stream=None)
+
+        jac = comp._jacobian
+        for meta in comp._subjacs_info.values():
+            self.assertIs(meta['value'].base, jac._value_pool)
+
+        dR_do = np.array([[-4., 0., 0., 0., 0.],
+                          [0., -5., 0., 0., 0.],
+                          [1., 0., -6., 0., 0.],
+                          [0., 0., 9., -2., 0.],
+                          [10., 0., 0., 0., -3.]])
+        dR_da = np.array([[0., 0., 1.],
+                          [0., 2., 0.],
+                          [3., 0., 0.],
+                          [0., 0., 0.],
+                          [0., 0., 0.]])
+        J = p.compute_totals(of=['C1.x', 'C1.y'], wrt=['indeps.a'], return_format='array')
+        assert_near_equal(J, -np.linalg.solve(dR_do, dR_da), 1e-12)
+
+    def test_subjac_value_pool_late_partials(self):
+        # MetaModelUnStructuredComp declares its partials after Component._setup_partials
+        p = Problem()
+        model = p.model
+        model.add_subsystem('indeps', IndepVarComp('x', np.array([.5, 1., 1.5])))
+        comp = model.add_subsystem('mm', MetaModelUnStructuredComp(
+            vec_size=3, default_surrogate=ResponseSurface()))
+        comp.add_input('x', np.zeros(3), training_data=np.linspace(0., 2., 5))
+        comp.add_output('y', np.zeros(3), training_data=np.linspace(0., 2., 5) ** 2)
+        comp.add_output('z', np.zeros(3), training_data=3. * np.linspace(0., 2., 5))
+        model.connect('indeps.x', 'mm.x')
+        p.setup()
+        p.run_model()
+
+        J = p.compute_totals(of=['mm.y', 'mm.z'], wrt=['indeps.x'], return_format='array')
+        assert_near_equal(J, np.vstack([np.diag([1., 2., 3.]), 3. * np.eye(3)]), 1e-10)
+
+        jac = comp._jacobian
+        self.assertIn(('mm.y', 'mm.x'), jac._pool_offsets)
+        self.assertIn(('mm.z', 'mm.x'), jac._pool_offsets)
+        for meta in comp._subjacs_info.values():
+            self.assertIs(meta['value'].base, jac._value_pool)
+
+    def test_shared_iter_keys(self):
+        p = Problem()
+        model = p.model
+        indeps = model.add_subsystem('indeps', IndepVarComp())
+        indeps.add_output('p', np.ones(2))
+        indeps.add_output('q', np.ones(2))
+        indeps.add_output('b', 3. * np.ones(2))
+        model.add_subsystem('C0', ExecComp('a=p+2*q', a=np.ones(2), p=np.ones(2), q=np.ones(2)))
+        comp = model.add_subsystem('C1', ExecComp('y=a*b', a=np.ones(2), b=np.ones(2),
+                                                  y=np.ones(2)))
+        model.connect('indeps.p', 'C0.p')
+        model.connect('indeps.q', 'C0.q')
+        model.connect('indeps.b', 'C1.b')
+        model.connect('C0.a', 'C1.a')
+        model.add_design_var('indeps.p', vectorize_derivs=True)
+        model.add_design_var('indeps.q', vectorize_derivs=True)
+        model.add_constraint('C1.y', lower=0.0)
+        p.setup(mode='fwd')
+        p.run_model()
+
+        J = p.compute_totals(return_format='array')
+        assert_near_equal(J, np.array([[3., 0., 6., 0.], [0., 3., 0., 6.]]), 1e-12)
+
+        # both design vars see the same relevant variables in C1, so they share one key list
+        iter_keys = comp._jacobian._iter_keys
+        self.assertIs(iter_keys['C1', 'indeps.p'], iter_keys['C1', 'indeps.q'])
+        self.assertIsNot(iter_keys['C1', 'indeps.p'], iter_keys['C1', 'linear'])
+
+
 class MaskingTestCase(unittest.TestCase):
     def test_csc_masking(self):
         class CCBladeResidualComp(ImplicitComponent):